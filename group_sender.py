@@ -1,16 +1,19 @@
 import socket
 import struct
+import ctypes
+import os
 import time
-import ntplib
-from collections import defaultdict
+from array import array
 import sys
 from datetime import datetime
 import re
-import matplotlib.pyplot as plt
 import numpy as np
 import threading
+import selectors
+import errno
 import argparse  # Add this import for command-line argument parsing
 import ipaddress
+import subprocess
 import netifaces  # New import for network interface detection
 
 # Parse command-line arguments
@@ -24,6 +27,10 @@ def parse_arguments():
                         help="Discovery timeout in seconds (default: 5)")
     parser.add_argument("-n", "--network", default=None,
                         help="Specific network to use (e.g., 192.168.1.0/24)")
+    parser.add_argument("--plot-only", metavar="LOG_FILE", default=None,
+                        help="Skip the test and only analyze/plot an existing log file")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="Log every response and its delay (needed for --plot-only on this log)")
     return parser.parse_args()
 
 # Get command-line arguments
@@ -32,12 +39,15 @@ WIFI_TYPE = args.wifi_type
 MEASUREMENT_ITERATIONS = args.iterations
 DISCOVERY_TIMEOUT = args.timeout
 SPECIFIED_NETWORK = args.network
+PLOT_ONLY_LOG = args.plot_only
+VERBOSE = args.verbose
 
 # Redirect print output to a log file with a timestamped name
-log_file_path = f"{WIFI_TYPE}_test_log_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
-log_file = open(log_file_path, "w", encoding="utf-8")
-sys.stdout = log_file
-sys.stderr = log_file
+if PLOT_ONLY_LOG is None:
+    log_file_path = f"{WIFI_TYPE}_test_log_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
+    log_file = open(log_file_path, "w", encoding="utf-8")
+    sys.stdout = log_file
+    sys.stderr = log_file
 
 # Configuration constants
 BROADCAST_PORT = 5688
@@ -45,43 +55,294 @@ LISTEN_PORT = 5688
 UNICAST_PORT = 5683
 RESPONSE_PORT = 5684
 
+# SNTP (RFC 4330) packet: LI/VN/mode, stratum, poll, precision, root delay,
+# root dispersion, reference id, then the reference/originate/receive/transmit stamps
+NTP_PORT = 123
+SNTP_STRUCT = struct.Struct("!BBBbIIIQQQQ")
+NTP_EPOCH_OFFSET = 2208988800  # Seconds from 1900-01-01 (NTP epoch) to 1970-01-01
+NTP_TIMEOUT = 0.5  # Fail fast on an offline bench instead of stalling the run
+TIMESYNCD_SYNCHRONIZED = "/run/systemd/timesyncd/synchronized"  # Exists once timesyncd has synced
+
+# Kernel socket buffer size; the default (~208 KB) overflows when many devices
+# answer the same broadcast or round at once, silently dropping responses.
+# Linux caps the request at net.core.rmem_max / wmem_max (macOS/BSD refuse it, see
+# set_socket_buffers), so on the test host also run:
+#   sysctl -w net.core.rmem_max=12582912 net.core.wmem_max=12582912
+#   sysctl -w net.core.netdev_max_backlog=5000
+SOCKET_BUFFER_SIZE = 12 * 1024 * 1024
+
 CMD_LED_COLOR = 3
 COLORS = [
     (255, 0, 0), (0, 255, 0), (0, 0, 255),
     (255, 255, 0), (255, 0, 255), (16, 16, 16)
 ]
 
+# Wire formats, compiled once instead of re-parsing the format string per packet
+CMD_STRUCT = struct.Struct("<IQBBBB")  # seq, t1, cmd, r, g, b
+RESP_STRUCT = struct.Struct("<IQQH")  # seq, t2, t3, receiver id
+
+# NTP server name -> resolved IP, and the UDP socket reused for every SNTP query
+ntp_server_ips = {}
+ntp_sock = None
+
 # Updated to store both short_id and wifi mode (6 or 4)
 discovered_devices = {}  # ip -> (short_id, wifi_mode)
-# Separate delay records for WiFi 6 and WiFi 4 devices
-wifi6_delay_records = defaultdict(list)  # ip -> list of delays for WiFi 6 devices
-wifi4_delay_records = defaultdict(list)  # ip -> list of delays for WiFi 4 devices
-delay_records = defaultdict(list)  # ip -> list of delays (for backward compatibility)
+# Dense per-device index assigned once at discovery. The receive path maps a response's
+# source address to it with a single string lookup; all other per-device state is
+# indexed by this int rather than re-hashing the dotted-quad string per packet
+device_index = {}  # ip -> index
+device_ips = []  # index -> ip
+device_wifi_modes = []  # index -> wifi mode
+device_wifi_types = []  # index -> "WiFi 6" / "WiFi 4" label, resolved once for the log
+# Unicast destinations resolved once at discovery and reused for every round
+device_dsts = []  # index -> (ip, UNICAST_PORT) for sendto
+device_sockaddrs = []  # index -> sockaddr_in for sendmmsg
+# recvmmsg hands back raw sockaddr_in structs: sin_addr read as a native-endian
+# uint32 maps straight to the device index without building an IP string
+device_addr_keys = {}  # sin_addr as native uint32 -> index
+# Running per-device delay statistics, one row per device index, updated in place
+# per response so the averages need no pass over the samples. The raw samples the
+# plots are drawn from live in response_records (devices x iterations rows)
+DELAY_STATS_DTYPE = np.dtype([('n', 'i4'), ('sum', 'f8'), ('sum2', 'f8'), ('min', 'f4'), ('max', 'f4')])
+delay_stats = np.zeros(0, dtype=DELAY_STATS_DTYPE)
+
+# Starting sequence numbers for each WiFi type to avoid conflicts
+WIFI6_SEQ_START = 1000
+WIFI4_SEQ_START = 2000
 
 # 用于存储每轮测量的发送时间和序号
-pending_commands = {}  # (ip, seq) -> t1
+# One t1 slot per round, indexed by seq - device_seq_base[idx]: the hot path is a
+# plain array index with no hashing, and a slot is zeroed once its response is used
+pending_commands = []  # index -> array('q') of MEASUREMENT_ITERATIONS t1 slots (ns), 0 = empty
+device_seq_base = []  # index -> first seq of the device's WiFi mode test
+
+# Round barrier: seq -> device indices still owing a response, so a round ends as
+# soon as its responses are in instead of after a fixed sleep
+round_waiters = {}
+ROUND_TIMEOUT = 1.5  # Upper bound on how long a round waits for stragglers
+ROUND_INTERVAL_NS = 1_000_000_000  # Rounds are sent on fixed ticks this far apart
+
+# Scheduling for the measurement loop: SCHED_FIFO priority, or niceness if that's refused
+RECEIVER_RT_PRIORITY = 50
+RECEIVER_NICE = -10
+
+# Every handled response as a fixed-size row in a preallocated record array (each
+# device answers each round at most once); nothing is formatted or written to the
+# log until write_response_log runs after the last round (and only with --verbose)
+RESPONSE_RECORD_DTYPE = np.dtype([('idx', 'i4'), ('seq', 'u4'), ('delay', 'f4')])
+response_records = np.zeros(0, dtype=RESPONSE_RECORD_DTYPE)
+response_count = 0
+
+
+def set_socket_buffers(sock):
+    for option in (socket.SO_RCVBUF, socket.SO_SNDBUF):
+        # Linux silently caps an oversized request, but macOS and the BSDs reject it
+        # with ENOBUFS (kern.ipc.maxsockbuf), so halve until the kernel accepts one
+        size = SOCKET_BUFFER_SIZE
+        while True:
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, option, size)
+                break
+            except OSError:
+                size //= 2
+                if size < 64 * 1024:
+                    break  # Keep the default buffer
+
+
+def warn_if_rcvbuf_capped(sock):
+    """Warn when the kernel granted less receive buffer than SOCKET_BUFFER_SIZE"""
+    # Linux grants min(request, rmem_max) and reports it doubled (the extra half covers
+    # bookkeeping), so an uncapped buffer reads back as 2 * SOCKET_BUFFER_SIZE there;
+    # other kernels report the size set_socket_buffers got accepted
+    granted = sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+    if sys.platform.startswith("linux"):
+        if granted < 2 * SOCKET_BUFFER_SIZE:
+            print(f"⚠️ Receive buffer capped at {granted // 2} bytes; responses may be dropped under load. "
+                  f"Raise net.core.rmem_max to {SOCKET_BUFFER_SIZE} (see SOCKET_BUFFER_SIZE)")
+    elif granted < SOCKET_BUFFER_SIZE:
+        print(f"⚠️ Receive buffer capped at {granted} bytes; responses may be dropped under load. "
+              f"Raise the kernel's socket buffer limit (kern.ipc.maxsockbuf) above {SOCKET_BUFFER_SIZE}")
+
+
+# Single UDP socket shared by every unicast color command, so sending doesn't
+# pay a socket()/close() pair per packet
+unicast_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+set_socket_buffers(unicast_sock)
+
+# Opt the send socket into MSG_ZEROCOPY where the kernel supports it (UDP: Linux 5.0+).
+# The flag itself isn't passed: pinning the buffer and reaping the completion costs
+# more than copying the 16-byte command, so it only pays off for payloads of ~10 KB+
+if sys.platform.startswith("linux"):
+    try:
+        unicast_sock.setsockopt(socket.SOL_SOCKET, getattr(socket, "SO_ZEROCOPY", 60), 1)
+    except OSError:
+        pass
+
+
+# Linux sendmmsg(2) structures, used to fan one color command out to every
+# device in a single syscall
+class iovec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+
+class sockaddr_in(ctypes.Structure):
+    _fields_ = [
+        ("sin_family", ctypes.c_ushort),
+        ("sin_port", ctypes.c_uint16),  # network byte order
+        ("sin_addr", ctypes.c_uint8 * 4),
+        ("sin_zero", ctypes.c_uint8 * 8),
+    ]
+
+
+class msghdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_name", ctypes.c_void_p),
+        ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.POINTER(iovec)),
+        ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p),
+        ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int),
+    ]
+
+
+class mmsghdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", msghdr), ("msg_len", ctypes.c_uint)]
+
+
+# Batched send/receive syscalls from glibc; either stays None where unavailable
+# (non-Linux, other libcs) and the per-datagram sendto/recvfrom_into loops are used
+sendmmsg = None
+recvmmsg = None
+if sys.platform.startswith("linux"):
+    try:
+        libc = ctypes.CDLL("libc.so.6", use_errno=True)
+    except OSError:
+        libc = None
+    if libc is not None:
+        try:
+            sendmmsg = libc.sendmmsg
+            sendmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int]
+            sendmmsg.restype = ctypes.c_int
+        except AttributeError:
+            sendmmsg = None
+        try:
+            recvmmsg = libc.recvmmsg
+            recvmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+            recvmmsg.restype = ctypes.c_int
+        except AttributeError:
+            recvmmsg = None
+
+RECV_BATCH = 64  # Datagrams pulled per recvmmsg call
+RECV_SLOT_SIZE = 64  # Bytes per datagram slot; responses are RESP_STRUCT.size bytes
+# (t1, t2, t3, t4) of each matched response in the current batch (host stamps in ns,
+# device stamps in µs), plus its device and seq, so the delay arithmetic runs once
+# per batch in NumPy instead of per packet
+response_stamps = np.empty((RECV_BATCH, 4), dtype=np.int64)
+stamp_idx = np.empty(RECV_BATCH, dtype=np.intp)
+stamp_seq = np.empty(RECV_BATCH, dtype=np.uint32)
+
+# Kernel RX timestamps (Linux SO_TIMESTAMPNS): t4 is when the datagram reached the
+# socket, not when the Python thread got around to reading it. The control message
+# is a cmsghdr followed by a struct timespec on CLOCK_REALTIME
+RX_TIMESTAMPS = sys.platform.startswith("linux")
+SO_TIMESTAMPNS = getattr(socket, "SO_TIMESTAMPNS", 35)
+TIMESTAMP_CMSG = struct.Struct("@Niill")  # cmsg_len, cmsg_level, cmsg_type, tv_sec, tv_nsec
+TIMESTAMP_DATA = struct.Struct("@ll")  # tv_sec, tv_nsec
+
+SO_BINDTODEVICE = getattr(socket, "SO_BINDTODEVICE", 25)
+
+
+def resolve_host(host, timeout):
+    """gethostbyname with a deadline; it has no timeout of its own and an unreachable
+    resolver can stall it for seconds, so the lookup runs on a daemon worker thread"""
+    result = {}
+
+    def lookup():
+        try:
+            result['ip'] = socket.gethostbyname(host)
+        except OSError as e:
+            result['error'] = e
+
+    worker = threading.Thread(target=lookup, daemon=True)
+    worker.start()
+    worker.join(timeout)
+    if 'error' in result:
+        raise result['error']
+    if 'ip' not in result:
+        raise socket.timeout(f"resolving {host} timed out after {timeout}s")
+    return result['ip']
+
+
+def sntp_query(ntp_server, timeout=NTP_TIMEOUT):
+    """Return the server's transmit time (Unix seconds) from one SNTP exchange"""
+    global ntp_sock
+    server_ip = ntp_server_ips.get(ntp_server)
+    if server_ip is None:
+        server_ip = ntp_server_ips[ntp_server] = resolve_host(ntp_server, timeout)
+    if ntp_sock is None:
+        ntp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    ntp_sock.settimeout(timeout)
+
+    # Our transmit stamp comes back as the originate stamp, which tells the reply to
+    # this request apart from a late reply to an earlier one on the reused socket
+    now = time.time()
+    our_stamp = (int(now) + NTP_EPOCH_OFFSET) << 32 | int((now % 1) * 2**32)
+    request = SNTP_STRUCT.pack(0x1B, 0, 0, 0, 0, 0, 0, 0, 0, 0, our_stamp)  # LI 0, VN 3, mode 3 (client)
+    ntp_sock.sendto(request, (server_ip, NTP_PORT))
+    while True:
+        data, _ = ntp_sock.recvfrom(512)
+        if len(data) < SNTP_STRUCT.size:
+            continue
+        fields = SNTP_STRUCT.unpack_from(data)
+        originate, transmit = fields[8], fields[10]
+        if originate == our_stamp:
+            return (transmit >> 32) - NTP_EPOCH_OFFSET + (transmit & 0xFFFFFFFF) / 2**32
+
+
+def system_clock_synchronized():
+    """True if a local daemon (systemd-timesyncd, chrony, ntpd) already keeps the clock in sync"""
+    if os.path.exists(TIMESYNCD_SYNCHRONIZED):
+        return True
+    try:
+        result = subprocess.run(["timedatectl", "show", "-p", "NTPSynchronized", "--value"],
+                                capture_output=True, text=True, timeout=1)
+    except (OSError, subprocess.SubprocessError):
+        return False
+    return result.stdout.strip() == "yes"
 
 
 def sync_time_with_ntp(ntp_server='ntp1.aliyun.com'):
+    # Grab the system time before anything else can delay it
+    now = time.time()
+    if system_clock_synchronized():
+        print(f" System clock already NTP-synchronized, skipping query: "
+              f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(now))}")
+        return
     try:
-        client = ntplib.NTPClient()
-        response = client.request(ntp_server, version=3)
-        system_time = time.localtime(response.tx_time)
+        tx_time = sntp_query(ntp_server)
+        system_time = time.localtime(tx_time)
         print(f" NTP Time synced: {time.strftime('%Y-%m-%d %H:%M:%S', system_time)}")
     except Exception as e:
         print(f"⚠️ NTP sync failed: {e}")
 
 
 def get_broadcast_addresses():
-    """Get broadcast addresses for all available network interfaces"""
+    """Get (interface, local IP, broadcast address) for all available network interfaces.
+
+    Interface and local IP are None for fallback addresses that no interface
+    was found for.
+    """
     broadcast_addresses = []
     
     # If user specified a network, use that
     if SPECIFIED_NETWORK:
         try:
             network = ipaddress.IPv4Network(SPECIFIED_NETWORK, strict=False)
-            broadcast_addresses.append(str(network.broadcast_address))
-            print(f" Using specified network: {SPECIFIED_NETWORK}, broadcast: {network.broadcast_address}")
+            interface, local_ip = find_interface_in_network(network)
+            broadcast_addresses.append((interface, local_ip, str(network.broadcast_address)))
+            print(f" Using specified network: {SPECIFIED_NETWORK}, broadcast: {network.broadcast_address}"
+                  f"{f' via {interface}' if interface else ''}")
             return broadcast_addresses
         except ValueError as e:
             print(f"⚠️ Invalid network specification: {e}. Will use auto-detection.")
@@ -98,39 +359,103 @@ def get_broadcast_addresses():
                         broadcast = addr['broadcast']
                         # Skip loopback and link-local addresses
                         if not broadcast.startswith('127.') and not broadcast.startswith('169.254.'):
-                            broadcast_addresses.append(broadcast)
+                            broadcast_addresses.append((interface, addr.get('addr'), broadcast))
                             print(f" Found interface: {interface} with broadcast: {broadcast}")
     except Exception as e:
         print(f"⚠️ Error detecting network interfaces: {e}")
         # Fallback to common broadcast addresses
         fallback_broadcasts = ['192.168.1.255', '192.168.0.255']
         print(f" Falling back to common broadcast addresses: {fallback_broadcasts}")
-        broadcast_addresses.extend(fallback_broadcasts)
+        broadcast_addresses.extend((None, None, broadcast) for broadcast in fallback_broadcasts)
     
     # If no addresses found, add common ones as fallback
     if not broadcast_addresses:
         fallback_broadcasts = ['192.168.1.255', '192.168.0.255']
         print(f" No broadcast addresses found. Using fallback addresses: {fallback_broadcasts}")
-        broadcast_addresses.extend(fallback_broadcasts)
+        broadcast_addresses.extend((None, None, broadcast) for broadcast in fallback_broadcasts)
     
     return broadcast_addresses
 
-def send_broadcast_and_collect_responses():
+
+def find_interface_in_network(network):
+    """Return (interface, local IP) of the first interface with an address in network"""
+    try:
+        for interface in netifaces.interfaces():
+            for addr in netifaces.ifaddresses(interface).get(netifaces.AF_INET, []):
+                if 'addr' in addr and ipaddress.IPv4Address(addr['addr']) in network:
+                    return interface, addr['addr']
+    except Exception as e:
+        print(f"⚠️ Error detecting network interfaces: {e}")
+    return None, None
+
+
+def open_discovery_socket(interface, local_ip):
+    """Open a LISTEN_PORT socket whose broadcasts leave through interface.
+
+    SO_BINDTODEVICE pins egress (and ingress) to the interface; it needs
+    CAP_NET_RAW, so without it the socket is bound to the interface's own
+    address instead. SO_REUSEADDR lets one such socket per interface share the port.
+    """
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    set_socket_buffers(sock)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-    sock.settimeout(1)
-    sock.bind(('', LISTEN_PORT))
+    bind_ip = ''
+    if interface is not None:
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, SO_BINDTODEVICE, interface.encode())
+        except OSError as e:
+            print(f"⚠️ Could not bind to device {interface} ({e}); binding to {local_ip} instead")
+            bind_ip = local_ip or ''
+    if local_ip:
+        # Keeps a future multicast discovery on the same interface
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(local_ip))
+    sock.bind((bind_ip, LISTEN_PORT))
+    sock.setblocking(False)
+    return sock
 
-    # Get all broadcast addresses
-    broadcast_addresses = get_broadcast_addresses()
-    
-    # Send broadcast to all addresses
-    for broadcast_addr in broadcast_addresses:
+
+def register_device(ip, short_id, wifi_mode):
+    """Record a newly discovered device and precompute its per-device lookups"""
+    idx = len(device_ips)
+    discovered_devices[ip] = (short_id, wifi_mode)
+    device_index[ip] = idx
+    device_ips.append(ip)
+    device_wifi_modes.append(wifi_mode)
+    device_wifi_types.append("WiFi 6" if wifi_mode == 6 else "WiFi 4")
+    device_dsts.append((ip, UNICAST_PORT))
+    device_sockaddrs.append(make_sockaddr(ip, UNICAST_PORT))
+    device_addr_keys[int.from_bytes(socket.inet_aton(ip), sys.byteorder)] = idx
+
+
+def send_broadcast_and_collect_responses():
+    # Get all broadcast addresses, grouped by the interface they go out of
+    targets = {}
+    for interface, local_ip, broadcast_addr in get_broadcast_addresses():
+        targets.setdefault((interface, local_ip), []).append(broadcast_addr)
+
+    # One socket per interface, so each broadcast leaves through its own NIC instead
+    # of wherever the routing table sends it; responses from all of them are
+    # collected through one selector
+    selector = selectors.DefaultSelector()
+    for (interface, local_ip), broadcasts in targets.items():
         try:
-            sock.sendto(b'ESP_DISCOVER_RECEIVERS', (broadcast_addr, BROADCAST_PORT))
-            print(f" Broadcast sent to {broadcast_addr}:{BROADCAST_PORT}")
-        except Exception as e:
-            print(f"⚠️ Failed to send broadcast to {broadcast_addr}: {e}")
+            sock = open_discovery_socket(interface, local_ip)
+        except OSError as e:
+            print(f"⚠️ Failed to open discovery socket for {interface or 'default route'}: {e}")
+            continue
+        if not selector.get_map():
+            warn_if_rcvbuf_capped(sock)
+        selector.register(sock, selectors.EVENT_READ)
+
+        # Send broadcast to all addresses of this interface
+        for broadcast_addr in broadcasts:
+            try:
+                sock.sendto(b'ESP_DISCOVER_RECEIVERS', (broadcast_addr, BROADCAST_PORT))
+                print(f" Broadcast sent to {broadcast_addr}:{BROADCAST_PORT}"
+                      f"{f' via {interface}' if interface else ''}")
+            except Exception as e:
+                print(f"⚠️ Failed to send broadcast to {broadcast_addr}: {e}")
     
     print(f" Listening on port {LISTEN_PORT} for {DISCOVERY_TIMEOUT} seconds...\n")
 
@@ -147,8 +472,11 @@ def send_broadcast_and_collect_responses():
             print(f"⏳ Waiting: {remaining:>2}s remaining...")
             last_printed_second = remaining
 
-        try:
-            data, addr = sock.recvfrom(1024)
+        for key, _ in selector.select(timeout=min(1, max(0, DISCOVERY_TIMEOUT - (time.time() - start_time)))):
+            try:
+                data, addr = key.fileobj.recvfrom(1024)
+            except BlockingIOError:
+                continue
             ip = addr[0]
             message = data.decode().strip()
             if message.startswith("ESP_RECEIVER_ID:"):
@@ -164,7 +492,7 @@ def send_broadcast_and_collect_responses():
                         print(f"⚠️ Invalid WiFi mode format from {ip}: {message}")
                 
                 if ip not in discovered_devices:
-                    discovered_devices[ip] = (short_id, wifi_mode)
+                    register_device(ip, short_id, wifi_mode)
                     if wifi_mode == 6:
                         wifi6_count += 1
                         wifi_type = "WiFi 6"
@@ -172,163 +500,459 @@ def send_broadcast_and_collect_responses():
                         wifi4_count += 1
                         wifi_type = "WiFi 4"
                     print(f"✅ Response from {ip}: {message} ({wifi_type})")
-        except socket.timeout:
-            time.sleep(0.1)
-            continue
 
-    sock.close()
+    for key in list(selector.get_map().values()):
+        key.fileobj.close()
+    selector.close()
     print(f"\n Discovery phase ended. Found {wifi6_count} WiFi 6 devices and {wifi4_count} WiFi 4 devices.\n")
 
 
-def send_color_command(ip, r, g, b, seq, sock=None):
-    should_close = False
+# Commands are packed into one reusable buffer instead of a new bytes object per
+# send; a ctypes buffer so sendmmsg's iovec can point straight at it. sendmmsg copies
+# the payload before returning, so every mode's batch can share it
+command_buffer = ctypes.create_string_buffer(CMD_STRUCT.size)
+# id(target dict) -> (target dict, device indices, mmsghdr array pointing at command_buffer)
+send_batches = {}
+
+
+def make_sockaddr(ip, port):
+    addr = sockaddr_in()
+    addr.sin_family = socket.AF_INET
+    addr.sin_port = socket.htons(port)
+    addr.sin_addr = (ctypes.c_uint8 * 4).from_buffer_copy(socket.inet_aton(ip))
+    return addr
+
+
+def make_send_msgs(payload, indices):
+    """Build one mmsghdr per device index, all pointing at the ctypes buffer payload"""
+    iov = iovec(ctypes.cast(payload, ctypes.c_void_p), len(payload))
+    msgs = (mmsghdr * len(indices))()
+    for i, idx in enumerate(indices):
+        hdr = msgs[i].msg_hdr
+        hdr.msg_name = ctypes.addressof(device_sockaddrs[idx])
+        hdr.msg_namelen = ctypes.sizeof(sockaddr_in)
+        hdr.msg_iov = ctypes.pointer(iov)
+        hdr.msg_iovlen = 1
+    return msgs
+
+
+def command_batch(ips):
+    """Return (indices, mmsghdr array) for sending command_buffer to ips.
+
+    Cached per ips object, so a mode passing the same target dict every round
+    builds it once and each round only repacks the payload the headers point at.
+    """
+    cached = send_batches.get(id(ips))
+    if cached is None or cached[0] is not ips:
+        indices = [device_index[ip] for ip in ips]
+        msgs = make_send_msgs(command_buffer, indices) if sendmmsg is not None else None
+        cached = send_batches[id(ips)] = (ips, indices, msgs)
+    return cached[1], cached[2]
+
+
+def send_msgs(sock, msgs, flags=0):
+    """Send a prepared mmsghdr array with as few sendmmsg(2) calls as possible"""
+    count = len(msgs)
+    sent = 0
+    while sent < count:
+        # sendmmsg may stop early (e.g. full send buffer); resume where it left off
+        n = sendmmsg(sock.fileno(), ctypes.byref(msgs, sent * ctypes.sizeof(mmsghdr)), count - sent, flags)
+        if n < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        sent += n
+
+
+def send_color_command_to_devices(ips, r, g, b, seq, sock=None):
+    """Send one color command to all ips, recording pending_commands before the send.
+
+    All devices share the same t1. On Linux the fan-out is a single sendmmsg call,
+    elsewhere it falls back to one sendto per device.
+    """
     if sock is None:
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        should_close = True
-    try:
-        t1 = int(time.time() * 1_000_000)
-        message = struct.pack("<IQBBBB", seq, t1, CMD_LED_COLOR, r, g, b)
-        sock.sendto(message, (ip, UNICAST_PORT))
-        print(f" Sent color to {ip}: RGB({r},{g},{b}), seq={seq}")
-    finally:
-        if should_close:
-            sock.close()
+        sock = unicast_sock
+    indices, msgs = command_batch(ips)
+    # Host stamps (t1/t4) are integer perf_counter nanoseconds: monotonic, so a clock
+    # step (e.g. NTP) mid-run can't corrupt t4 - t1, and kept in ns until the delay is
+    # computed. The device clock only enters as the t3 - t2 difference. The packet
+    # still carries t1 in microseconds, like the device's own stamps
+    t1 = time.perf_counter_ns()
+    message = command_buffer
+    CMD_STRUCT.pack_into(message, 0, seq, t1 // 1000, CMD_LED_COLOR, r, g, b)
+    # Register before sending so a fast response can never beat its own entry
+    for idx in indices:
+        pending_commands[idx][seq - device_seq_base[idx]] = t1
+    if sendmmsg is not None:
+        send_msgs(sock, msgs)
+    else:
+        for idx in indices:
+            sock.sendto(message, device_dsts[idx])
+    # One log line per round rather than per device keeps stdout writes out of the fan-out
+    print(f" Sent color RGB({r},{g},{b}), seq={seq} to {len(indices)} device(s): "
+          f"{', '.join(device_ips[idx] for idx in indices)}")
     return t1
 
 
-def response_listener(stop_event, timeout=2):
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    sock.bind(('', RESPONSE_PORT))
-    sock.settimeout(0.2)
-    end_time = time.time() + timeout
-    while not stop_event.is_set() and time.time() < end_time:
-        try:
-            data, addr = sock.recvfrom(1024)
-            t4 = int(time.time() * 1_000_000)
-            ip = addr[0]
-            if len(data) >= 22:
-                seq, t2, t3, rid = struct.unpack("<IQQH", data[:22])
-                key = (ip, seq)
-                t1 = pending_commands.get(key)
-                if t1 is not None:
-                    delay = ((t4 - t1) - (t3 - t2)) / 2 / 1000.0
-                    
-                    # Get WiFi mode for this device if available
-                    wifi_type = "Unknown"
-                    if ip in discovered_devices:
-                        _, wifi_mode = discovered_devices[ip]
-                        if wifi_mode == 6:
-                            wifi_type = "WiFi 6"
-                            wifi6_delay_records[ip].append(delay)
-                        else:
-                            wifi_type = "WiFi 4"
-                            wifi4_delay_records[ip].append(delay)
-                    
-                    # Also store in general delay records for backward compatibility
-                    delay_records[ip].append(delay)
-                    
-                    print(f" Response from {ip} ({wifi_type})")
-                    print(f"    ➤ Estimated One-way Delay ≈ {delay:.2f} ms")
-                    
-                    # 一个响应只处理一次
-                    del pending_commands[key]
-                else:
-                    print(f"⚠️ Response from {ip} with unknown seq={seq}")
-            else:
-                print(f"⚠️ Incomplete or unexpected data from {ip} ({len(data)} bytes)")
-        except socket.timeout:
+def open_round(seq, ips):
+    round_waiters[seq] = {device_index[ip] for ip in ips}
+
+
+def mark_round_response(idx, seq):
+    """Called once a response for (device idx, seq) has been handled"""
+    waiting = round_waiters.get(seq)
+    if waiting is not None:
+        waiting.discard(idx)
+        if not waiting:
+            del round_waiters[seq]
+
+
+def wait_for_round(selector, sock, batch, next_tick, timeout=ROUND_TIMEOUT):
+    """Handle responses on sock until every open round is answered (or timeout seconds
+    passed) and monotonic_ns() has reached next_tick"""
+    barrier_deadline = time.monotonic_ns() + int(timeout * 1e9)
+    while True:
+        now = time.monotonic_ns()
+        if round_waiters and now >= barrier_deadline:
+            # Stragglers still get recorded if they show up later, but no longer hold up a round
+            round_waiters.clear()
+        end = barrier_deadline if round_waiters else next_tick
+        if now >= end:
+            break
+        if selector.select((end - now) / 1e9):
+            drain_responses(sock, batch)
+
+
+def find_rx_cpu():
+    """Guess which CPU services the NIC's receive interrupts, from /proc/interrupts.
+
+    Sums the per-CPU counts of every IRQ line naming a non-loopback interface (or a
+    common WiFi driver) and returns the busiest CPU. If that can't be told, falls
+    back to the last CPU this process may run on, which is usually the least busy
+    one; None where affinity isn't supported.
+    """
+    try:
+        with open("/proc/interrupts", encoding="utf-8") as f:
+            cpu_count = len(f.readline().split())
+            irq_lines = f.readlines()
+    except OSError:
+        return last_allowed_cpu()
+
+    try:
+        nic_names = [name for name in netifaces.interfaces() if name != "lo"]
+    except Exception:
+        nic_names = []
+    nic_names += ["iwlwifi", "ath", "rtw", "mt76", "brcmf"]
+
+    totals = [0] * cpu_count
+    for line in irq_lines:
+        fields = line.split()
+        if len(fields) < 2 or not any(name in fields[-1] for name in nic_names):
             continue
-    sock.close()
+        for cpu, count in enumerate(fields[1:cpu_count + 1]):
+            if count.isdigit():
+                totals[cpu] += int(count)
+
+    if not any(totals):
+        return last_allowed_cpu()
+    return totals.index(max(totals))
+
 
+def last_allowed_cpu():
+    if not hasattr(os, "sched_getaffinity"):
+        return None
+    return max(os.sched_getaffinity(0))
 
-def response_listener_continuous(stop_event, response_queue):
-    """持续监听响应的线程函数，直到收到停止信号"""
+
+def pin_receiver_to_cpu(cpu):
+    """Keep the calling thread on one CPU, ideally the one servicing the NIC's RX
+    interrupts. Only the thread moves; steering the packets themselves is up to the
+    host's IRQ affinity / RPS settings.
+
+    Returns the thread's previous CPU set for restore_receiver_scheduling, or None
+    if the affinity wasn't changed.
+    """
+    if cpu is None or not hasattr(os, "sched_setaffinity"):
+        return None
+    tid = threading.get_native_id()
+    previous = os.sched_getaffinity(tid)
+    try:
+        os.sched_setaffinity(tid, {cpu})
+    except OSError as e:
+        print(f"⚠️ Could not pin receiver to CPU {cpu}: {e}")
+        return None
+    print(f" Receiver pinned to CPU {cpu}")
+    return previous
+
+
+def raise_receiver_priority():
+    """Run the calling thread ahead of other processes so t4 reads aren't delayed.
+
+    Tries real-time SCHED_FIFO first, then a negative nice value; both need
+    privileges (CAP_SYS_NICE), so either may fail and the thread keeps its priority.
+    Returns what restore_receiver_scheduling needs to undo the change, or None.
+    """
+    tid = threading.get_native_id()
+    if hasattr(os, "sched_setscheduler"):
+        try:
+            previous = ("sched", os.sched_getscheduler(tid), os.sched_getparam(tid))
+            os.sched_setscheduler(tid, os.SCHED_FIFO, os.sched_param(RECEIVER_RT_PRIORITY))
+            print(f" Receiver running SCHED_FIFO at priority {RECEIVER_RT_PRIORITY}")
+            return previous
+        except OSError:
+            pass
+    try:
+        # On Linux a thread id works as a pid here and renices just this thread
+        previous = ("nice", os.getpriority(os.PRIO_PROCESS, tid))
+        os.setpriority(os.PRIO_PROCESS, tid, RECEIVER_NICE)
+        print(f" Receiver niceness set to {RECEIVER_NICE}")
+        return previous
+    except (OSError, AttributeError) as e:
+        print(f"⚠️ Could not raise receiver priority: {e}")
+        return None
+
+
+def restore_receiver_scheduling(affinity, priority):
+    """Undo pin_receiver_to_cpu and raise_receiver_priority on the calling thread, so
+    the summary and plotting after the rounds don't run real-time on the RX CPU"""
+    tid = threading.get_native_id()
+    try:
+        if priority is not None and priority[0] == "sched":
+            os.sched_setscheduler(tid, priority[1], priority[2])
+        elif priority is not None:
+            os.setpriority(os.PRIO_PROCESS, tid, priority[1])
+        if affinity is not None:
+            os.sched_setaffinity(tid, affinity)
+    except OSError as e:
+        print(f"⚠️ Could not restore receiver scheduling: {e}")
+
+
+def open_response_socket():
+    """Create the RESPONSE_PORT socket once for the whole run instead of rebinding"""
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    set_socket_buffers(sock)
+    warn_if_rcvbuf_capped(sock)
     sock.bind(('', RESPONSE_PORT))
-    sock.settimeout(0.2)  # 短超时，使线程能定期检查停止事件
-    
-    print(" 持续监听器已启动，等待响应...")
-    
-    while not stop_event.is_set():
-        try:
-            data, addr = sock.recvfrom(1024)
-            t4 = int(time.time() * 1_000_000)
-            ip = addr[0]
-            
-            if len(data) >= 22:
-                seq, t2, t3, rid = struct.unpack("<IQQH", data[:22])
-                key = (ip, seq)
-                t1 = pending_commands.get(key)
-                if t1 is not None:
-                    delay = ((t4 - t1) - (t3 - t2)) / 2 / 1000.0
-                    
-                    # Get WiFi mode for this device if available
-                    wifi_type = "Unknown"
-                    if ip in discovered_devices:
-                        _, wifi_mode = discovered_devices[ip]
-                        if wifi_mode == 6:
-                            wifi_type = "WiFi 6"
-                            wifi6_delay_records[ip].append(delay)
-                        else:
-                            wifi_type = "WiFi 4"
-                            wifi4_delay_records[ip].append(delay)
-                    
-                    # Also store in general delay records for backward compatibility
-                    delay_records[ip].append(delay)
-                    
-                    print(f" Response from {ip} (seq={seq}, {wifi_type})")
-                    print(f"    ➤ Estimated One-way Delay ≈ {delay:.2f} ms")
-                    
-                    # 将处理过的响应放入队列（可用于其他分析）
-                    response_queue.append((ip, seq, delay))
-                    # 一个响应只处理一次
-                    del pending_commands[key]
+    if RX_TIMESTAMPS:
+        sock.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
+    # Readiness comes from a selector, then reads drain until EAGAIN
+    sock.setblocking(False)
+    return sock
+
+
+def kernel_stamp_to_t4(sec, nsec, clock_offset_ns):
+    """Convert a CLOCK_REALTIME kernel stamp to perf_counter nanoseconds, like t1"""
+    return sec * 1_000_000_000 + nsec - clock_offset_ns
+
+
+def make_recv_batch():
+    """Preallocate everything reused across receive calls.
+
+    With recvmmsg this is RECV_BATCH datagram slots in one buffer plus their
+    iovecs, source addresses, timestamp control buffers and mmsghdr entries;
+    otherwise a single bytearray.
+    """
+    if recvmmsg is None:
+        return bytearray(RECV_SLOT_SIZE)
+    slots = ctypes.create_string_buffer(RECV_BATCH * RECV_SLOT_SIZE)
+    controls = ctypes.create_string_buffer(RECV_BATCH * TIMESTAMP_CMSG.size)
+    addrs = (sockaddr_in * RECV_BATCH)()
+    iovs = (iovec * RECV_BATCH)()
+    msgs = (mmsghdr * RECV_BATCH)()
+    for i in range(RECV_BATCH):
+        iovs[i].iov_base = ctypes.addressof(slots) + i * RECV_SLOT_SIZE
+        iovs[i].iov_len = RECV_SLOT_SIZE
+        hdr = msgs[i].msg_hdr
+        hdr.msg_name = ctypes.addressof(addrs[i])
+        hdr.msg_namelen = ctypes.sizeof(sockaddr_in)
+        hdr.msg_iov = ctypes.pointer(iovs[i])
+        hdr.msg_iovlen = 1
+        hdr.msg_control = ctypes.addressof(controls) + i * TIMESTAMP_CMSG.size
+        hdr.msg_controllen = TIMESTAMP_CMSG.size
+    # Each sockaddr_in is four 32-bit words; word 1 is sin_addr
+    addr_words = memoryview(addrs).cast('B').cast('I')
+    return msgs, slots, addrs, addr_words, controls, iovs
+
+
+def match_response(idx, data, offset, n, t4, row):
+    """Match one response from device idx against pending_commands.
+
+    On a match its (t1, t2, t3, t4) stamps go into response_stamps[row], with the
+    device and seq alongside, and True is returned; the delay is computed later
+    for the whole batch by record_responses.
+    """
+    ip = device_ips[idx]
+    if n < RESP_STRUCT.size:
+        print(f"⚠️ Incomplete or unexpected data from {ip} ({n} bytes)")
+        return False
+
+    seq, t2, t3, rid = RESP_STRUCT.unpack_from(data, offset)
+    pending = pending_commands[idx]
+    slot = seq - device_seq_base[idx]
+    t1 = pending[slot] if 0 <= slot < len(pending) else 0
+    if not t1:
+        print(f"⚠️ Response from {ip} with unknown seq={seq}")
+        return False
+
+    response_stamps[row] = (t1, t2, t3, t4)
+    stamp_idx[row] = idx
+    stamp_seq[row] = seq
+    # 一个响应只处理一次
+    pending[slot] = 0
+    return True
+
+
+def record_responses(rows):
+    """Compute the delays of the first rows matched responses at once and record them"""
+    global response_count
+    t = response_stamps[:rows]
+    idx = stamp_idx[:rows]
+    # Host stamps are ns, device stamps µs; halve the round trip and report ms
+    delays = ((t[:, 3] - t[:, 0]) - (t[:, 2] - t[:, 1]) * 1000) * 0.5e-6
+
+    # ufunc.at applies repeated indices one by one, so two responses from one device still both count
+    np.add.at(delay_stats['n'], idx, 1)
+    np.add.at(delay_stats['sum'], idx, delays)
+    np.add.at(delay_stats['sum2'], idx, delays * delays)
+    np.minimum.at(delay_stats['min'], idx, delays)
+    np.maximum.at(delay_stats['max'], idx, delays)
+
+    end = response_count + rows
+    records = response_records[response_count:end]
+    records['idx'] = idx
+    records['seq'] = stamp_seq[:rows]
+    records['delay'] = delays
+    response_count = end
+
+    for i, seq in zip(idx.tolist(), stamp_seq[:rows].tolist()):
+        mark_round_response(i, seq)
+
+
+def drain_responses(sock, batch):
+    """Process every response already queued on the non-blocking sock.
+
+    Uses recvmmsg to pull up to RECV_BATCH datagrams per syscall where available,
+    otherwise one recvfrom_into per datagram; either way delays are computed per
+    batch of up to RECV_BATCH matched responses.
+    """
+    if recvmmsg is None:
+        rows = 0
+        while True:
+            try:
+                if RX_TIMESTAMPS:
+                    n, ancdata, _, addr = sock.recvmsg_into([batch], TIMESTAMP_CMSG.size)
                 else:
-                    print(f"⚠️ Response from {ip} with unknown seq={seq}")
+                    n, addr = sock.recvfrom_into(batch)
+                    ancdata = ()
+            except BlockingIOError:
+                if rows:
+                    record_responses(rows)
+                return
+            t4 = time.perf_counter_ns()
+            for level, cmsg_type, data in ancdata:
+                if level == socket.SOL_SOCKET and cmsg_type == SO_TIMESTAMPNS:
+                    sec, nsec = TIMESTAMP_DATA.unpack_from(data)
+                    t4 = kernel_stamp_to_t4(sec, nsec, time.time_ns() - time.perf_counter_ns())
+            idx = device_index.get(addr[0])
+            if idx is None:
+                print(f"⚠️ Response from undiscovered device {addr[0]}")
+            elif match_response(idx, batch, 0, n, t4, rows):
+                rows += 1
+                if rows == RECV_BATCH:
+                    record_responses(rows)
+                    rows = 0
+
+    msgs, slots, addrs, addr_words, controls, _ = batch
+    fd = sock.fileno()
+    while True:
+        count = recvmmsg(fd, msgs, RECV_BATCH, socket.MSG_DONTWAIT, None)
+        if count < 0:
+            err = ctypes.get_errno()
+            if err == errno.EINTR:
+                continue
+            if err in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            raise OSError(err, os.strerror(err))
+        # Sampled once per batch to move kernel (wall clock) stamps onto the perf_counter clock
+        now_ns = time.perf_counter_ns()
+        clock_offset_ns = time.time_ns() - now_ns
+        rows = 0
+        for i in range(count):
+            hdr = msgs[i].msg_hdr
+            _, level, cmsg_type, sec, nsec = TIMESTAMP_CMSG.unpack_from(controls, i * TIMESTAMP_CMSG.size)
+            if hdr.msg_controllen >= TIMESTAMP_CMSG.size and level == socket.SOL_SOCKET and cmsg_type == SO_TIMESTAMPNS:
+                t4 = kernel_stamp_to_t4(sec, nsec, clock_offset_ns)
             else:
-                print(f"⚠️ Incomplete or unexpected data from {ip} ({len(data)} bytes)")
-        except socket.timeout:
-            # 超时继续循环，这样可以检查stop_event
-            continue
-        except Exception as e:
-            print(f"❌ Error in response listener: {e}")
-    
-    print(" 持续监听器关闭中...")
-    sock.close()
+                t4 = now_ns
+            # The kernel shrinks msg_controllen to what it wrote; restore it for the next call
+            hdr.msg_controllen = TIMESTAMP_CMSG.size
+
+            idx = device_addr_keys.get(addr_words[i * 4 + 1])
+            if idx is None:
+                print(f"⚠️ Response from undiscovered device {socket.inet_ntoa(bytes(addrs[i].sin_addr))}")
+            elif match_response(idx, slots, i * RECV_SLOT_SIZE, msgs[i].msg_len, t4, rows):
+                rows += 1
+        if rows:
+            record_responses(rows)
+        if count < RECV_BATCH:
+            return  # Socket drained; skip the extra EAGAIN round trip
+
+
+def write_response_log():
+    """Format every recorded response into the log, in the order they were handled"""
+    lines = []
+    for idx, seq, delay in response_records[:response_count].tolist():
+        lines.append(f" Response from {device_ips[idx]} (seq={seq}, {device_wifi_types[idx]})")
+        lines.append(f"    ➤ Estimated One-way Delay ≈ {delay:.2f} ms")
+    if lines:
+        print("\n".join(lines))
+
+
+def allocate_delay_buffers():
+    """Preallocate one statistics row and one t1 slot array per discovered device,
+    plus room for every response of the run"""
+    global delay_stats, response_records, response_count
+    delay_stats = np.zeros(len(device_ips), dtype=DELAY_STATS_DTYPE)
+    delay_stats['min'] = np.inf
+    delay_stats['max'] = -np.inf
+    pending_commands[:] = [array('q', bytes(8 * MEASUREMENT_ITERATIONS)) for _ in device_ips]
+    device_seq_base[:] = [WIFI6_SEQ_START if mode == 6 else WIFI4_SEQ_START for mode in device_wifi_modes]
+    response_records = np.zeros(len(device_ips) * MEASUREMENT_ITERATIONS, dtype=RESPONSE_RECORD_DTYPE)
+    response_count = 0
+
+
+def print_device_delays(ips):
+    """Print each device's mean/stddev/min/max and return (total responses, total delay)"""
+    rows = delay_stats[[device_index[ip] for ip in ips]]
+    # Whole-group mean and variance in one vectorized step
+    with np.errstate(divide='ignore', invalid='ignore'):
+        means = rows['sum'] / rows['n']
+        stddevs = np.sqrt(np.maximum(rows['sum2'] / rows['n'] - means * means, 0.0))
+    for ip, row, mean, stddev in zip(ips, rows, means, stddevs):
+        if row['n']:
+            print(f"{ip:<16} : {mean:.2f} ms (stddev {stddev:.2f} ms, "
+                  f"min {row['min']:.2f} ms, max {row['max']:.2f} ms)")
+        else:
+            print(f"{ip:<16} : No responses")
+    return int(rows['n'].sum()), float(rows['sum'].sum())
 
 
 def print_average_delays():
     print("\n Average One-Way Delays per Device:")
     
+    wifi6_ips = [ip for ip, (_, wifi_mode) in discovered_devices.items() if wifi_mode == 6]
+    wifi4_ips = [ip for ip, (_, wifi_mode) in discovered_devices.items() if wifi_mode != 6]
+
     # For WiFi 6 devices
-    wifi6_total_delays = 0
-    wifi6_total_responses = 0
-    
-    if wifi6_delay_records:
+    wifi6_total_responses, wifi6_total_delays = 0, 0.0
+    if wifi6_ips:
         print("\n=== WiFi 6 Devices ===")
-        for ip, delays in wifi6_delay_records.items():
-            if delays:
-                avg_delay = sum(delays) / len(delays)
-                print(f"{ip:<16} : {avg_delay:.2f} ms")
-                wifi6_total_delays += sum(delays)
-                wifi6_total_responses += len(delays)
-            else:
-                print(f"{ip:<16} : No responses")
+        wifi6_total_responses, wifi6_total_delays = print_device_delays(wifi6_ips)
     
     # For WiFi 4 devices
-    wifi4_total_delays = 0
-    wifi4_total_responses = 0
-    
-    if wifi4_delay_records:
+    wifi4_total_responses, wifi4_total_delays = 0, 0.0
+    if wifi4_ips:
         print("\n=== WiFi 4 Devices ===")
-        for ip, delays in wifi4_delay_records.items():
-            if delays:
-                avg_delay = sum(delays) / len(delays)
-                print(f"{ip:<16} : {avg_delay:.2f} ms")
-                wifi4_total_delays += sum(delays)
-                wifi4_total_responses += len(delays)
-            else:
-                print(f"{ip:<16} : No responses")
+        wifi4_total_responses, wifi4_total_delays = print_device_delays(wifi4_ips)
     
     # Calculate and display total average time by WiFi type
     print("\n=== Summary ===")
@@ -355,102 +979,164 @@ def print_average_delays():
         print("Total Average Delay: No responses")
 
 
+# Log patterns used by analyze_wifi_time, compiled once (any IPv4 address, not just 192.168.1.x).
+# Bytes patterns so the log is scanned without decoding it; a response line and its
+# delay line are matched together, and the "(seq=N, WiFi X)" suffix yields the mode
+LOG_IP_PATTERN = rb'(\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})'
+LOG_MODE_RE = re.compile(rb'Response from ' + LOG_IP_PATTERN + rb'.*?\(WiFi (\d+)\)')
+LOG_RESPONSE_RE = re.compile(rb'Response from ' + LOG_IP_PATTERN + rb'(?: \(seq=\d+, WiFi (\d+)\))?[^\n]*\n'
+                             rb'[^\n]*?One-way Delay ' + '≈'.encode() + rb' ([\d.]+) ms')
+
+
 def analyze_wifi_time(file_path, wifi_type):
     # Read the WiFi time file
-    with open(file_path, 'r', encoding='utf-8') as file:
+    with open(file_path, 'rb') as file:
         content = file.read()
 
-    # Find all discovery responses to identify WiFi modes
-    wifi_modes = {}
-    # Updated pattern to match any IP address (not just 192.168.1.x)
-    mode_pattern = r'Response from (\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}).*?\((WiFi \d+)\)'
-    mode_matches = re.findall(mode_pattern, content)
-    for ip, mode in mode_matches:
-        wifi_modes[ip] = 6 if mode == "WiFi 6" else 4
-
-    # Find all IP addresses and their delays
-    # Updated pattern to match any IP address (not just 192.168.1.x)
-    pattern = r'Response from (\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}).*?\n.*?One-way Delay ≈ ([\d.]+) ms'
-    matches = re.findall(pattern, content)
-
-    # Dictionaries to store all delays for each IP
-    ip_delays = defaultdict(list)  # All devices
-    wifi6_ip_delays = defaultdict(list)  # WiFi 6 devices
-    wifi4_ip_delays = defaultdict(list)  # WiFi 4 devices
-
-    # Collect all delays for each IP in order
-    for ip, delay in matches:
-        delay_val = float(delay)
-        ip_delays[ip].append(delay_val)
-        
-        # Sort by WiFi mode if known
-        if ip in wifi_modes:
-            if wifi_modes[ip] == 6:
-                wifi6_ip_delays[ip].append(delay_val)
-            else:
-                wifi4_ip_delays[ip].append(delay_val)
-        # For IPs with unknown modes, try to determine from the content
+    # One pass collects every (ip, mode, delay) triple in log order
+    matches = LOG_RESPONSE_RE.findall(content)
+    ips = np.array([ip for ip, _, _ in matches])
+    delays = np.fromiter((float(delay) for _, _, delay in matches), dtype=np.float32, count=len(matches))
+
+    # Group delays by IP with a stable sort, keeping each device's samples in log order
+    unique_ips, first_seen, inverse, counts = np.unique(ips, return_index=True, return_inverse=True,
+                                                        return_counts=True)
+    order = np.argsort(inverse, kind='stable')
+    groups = np.split(delays[order], np.cumsum(counts)[:-1])
+
+    # Dictionaries to store all delays for each IP, as float32 arrays
+    ip_delays = {}  # All devices
+    wifi6_ip_delays = {}  # WiFi 6 devices
+    wifi4_ip_delays = {}  # WiFi 4 devices
+
+    wifi_modes = None
+    # Devices in the order they first answered, as before
+    for u in np.argsort(first_seen):
+        ip = unique_ips[u].decode()
+        ip_delays[ip] = groups[u]
+
+        mode = matches[first_seen[u]][1]
+        if mode:
+            wifi_mode = 6 if mode == b"6" else 4
         else:
+            # Older logs don't carry the mode on the response line; fall back to discovery
+            if wifi_modes is None:
+                wifi_modes = {m.group(1).decode(): int(m.group(2)) for m in LOG_MODE_RE.finditer(content)}
+            wifi_mode = wifi_modes.get(ip)
+        if wifi_mode is None:
             # Look for mentions of this IP with WiFi mode in the content
-            ip_wifi6_mention = re.search(rf"{ip}.*?WiFi 6", content)
-            ip_wifi4_mention = re.search(rf"{ip}.*?WiFi 4", content)
-            
+            ip_wifi6_mention = re.search(re.escape(ip.encode()) + rb".*?WiFi 6", content)
+            ip_wifi4_mention = re.search(re.escape(ip.encode()) + rb".*?WiFi 4", content)
+
             if ip_wifi6_mention and not ip_wifi4_mention:
-                wifi6_ip_delays[ip].append(delay_val)
-                wifi_modes[ip] = 6  # Remember for future references
+                wifi_mode = 6
             elif ip_wifi4_mention and not ip_wifi6_mention:
-                wifi4_ip_delays[ip].append(delay_val)
-                wifi_modes[ip] = 4  # Remember for future references
+                wifi_mode = 4
             else:
                 # If we can't determine, assume based on the test type
-                if wifi_type.lower() == "wifi6":
-                    wifi6_ip_delays[ip].append(delay_val)
-                else:
-                    wifi4_ip_delays[ip].append(delay_val)
+                wifi_mode = 6 if wifi_type.lower() == "wifi6" else 4
+
+        if wifi_mode == 6:
+            wifi6_ip_delays[ip] = groups[u]
+        else:
+            wifi4_ip_delays[ip] = groups[u]
 
     print(f"Analysis found {len(wifi6_ip_delays)} WiFi 6 devices and {len(wifi4_ip_delays)} WiFi 4 devices")
     return ip_delays, wifi6_ip_delays, wifi4_ip_delays
 
 
+def load_pyplot():
+    """Import pyplot on the non-interactive Agg backend, skipping any GUI toolkit setup.
+
+    Plotting only happens after the run, so matplotlib stays out of the
+    measurement process until here.
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
+
+
+# Figure shared by every plot_wifi_data call: (figure, axes, {ip: Line2D}, "no data" text).
+# Later calls only swap line data and labels instead of building a new figure
+grid_plot = None
+
+
+def get_grid_plot():
+    global grid_plot
+    if grid_plot is None:
+        plt = load_pyplot()
+        fig, ax = plt.subplots(figsize=(15, 8))
+        ax.set_xlabel('Test Number')
+        ax.set_ylabel('Delay (ms)')
+        ax.grid(True)
+        # Display a message when there's no data
+        no_data_text = ax.text(0.5, 0.5, "No data available to plot",
+                               ha='center', va='center',
+                               transform=ax.transAxes,
+                               fontsize=14, visible=False)
+        grid_plot = (fig, ax, {}, no_data_text)
+    return grid_plot
+
+
 def plot_wifi_data(ip_delays, wifi_type, y_min=None, y_max=None):
-    # Create a single figure
-    plt.figure(figsize=(15, 8))
+    fig, ax, lines, no_data_text = get_grid_plot()
 
-    # Track if we have plotted anything
-    has_data = False
+    # Hide lines left over from the previous plot; each IP keeps its line (and color)
+    for line in lines.values():
+        line.set_visible(False)
+
+    # Only plot IPs that have delay data
+    plotted = {ip: delays for ip, delays in ip_delays.items() if len(delays)}
+    has_data = bool(plotted)
+
+    # Track which lines we have plotted
+    shown = []
     
-    # Collect all delay values to determine automatic range if needed
-    all_delays = []
-
-    # Plot all IPs' data on the same figure
-    for ip, delays in ip_delays.items():
-        if delays:  # Only plot if we have delay data
-            all_delays.extend(delays)
-            x = np.arange(1, len(delays) + 1)  # Test numbers
-            avg_delay = np.mean(delays)
+    if has_data:
+        # One NaN-padded (IPs x tests) array, so the averages and the overall range
+        # used for automatic limits each come from a single NumPy call
+        max_len = max(map(len, plotted.values()))
+        all_delays = np.full((len(plotted), max_len), np.nan, dtype=np.float32)
+        for row, delays in zip(all_delays, plotted.values()):
+            row[:len(delays)] = delays
+        avg_delays = np.nanmean(all_delays, axis=1)
+        x = np.arange(1, max_len + 1)  # Test numbers
+
+        # Plot all IPs' data on the same figure
+        for (ip, delays), avg_delay in zip(plotted.items(), avg_delays):
+            line = lines.get(ip)
+            if line is None:
+                line, = ax.plot([], [], 'o-', linewidth=1, markersize=3)
+                lines[ip] = line
             # Plot the actual measurements with label including average
-            plt.plot(x, delays, 'o-', label=f'IP: {ip} (Avg: {avg_delay:.2f}ms)', linewidth=1, markersize=3)
-            has_data = True
+            line.set_data(x[:len(delays)], delays)
+            line.set_label(f'IP: {ip} (Avg: {avg_delay:.2f}ms)')
+            line.set_visible(True)
+            shown.append(line)
 
     # Set y-axis limits if provided, otherwise use auto-range with padding
     if has_data and (y_min is not None and y_max is not None):
-        plt.ylim(y_min, y_max)
-    elif has_data and all_delays:
+        ax.set_ylim(y_min, y_max)
+    elif has_data:
         # Add 10% padding above and below the min/max values
-        data_min = min(all_delays)
-        data_max = max(all_delays)
+        data_min = float(np.nanmin(all_delays))
+        data_max = float(np.nanmax(all_delays))
         range_padding = (data_max - data_min) * 0.1 if data_max > data_min else 10
-        plt.ylim(max(0, data_min - range_padding), data_max + range_padding)
+        ax.set_ylim(max(0, data_min - range_padding), data_max + range_padding)
+    ax.relim(visible_only=True)
+    ax.autoscale_view(scaley=not has_data)
 
-    plt.title('{} Response Times for All IPs'.format(wifi_type))
-    plt.xlabel('Test Number')
-    plt.ylabel('Delay (ms)')
-    plt.grid(True)
+    ax.set_title('{} Response Times for All IPs'.format(wifi_type))
 
     # Only create a legend if we actually plotted data
+    legend = ax.get_legend()
+    if legend is not None:
+        legend.remove()
     if has_data:
         # Improved legend settings
-        legend = plt.legend(
+        legend = ax.legend(
+            handles=shown,
             bbox_to_anchor=(1.05, 1),  # Position outside the plot
             loc='upper left',
             ncol=3,  # Number of columns
@@ -459,21 +1145,18 @@ def plot_wifi_data(ip_delays, wifi_type, y_min=None, y_max=None):
             title='IP Addresses (with averages)',
             title_fontsize=10
         )
-    else:
-        # Display a message when there's no data
-        plt.text(0.5, 0.5, "No data available to plot", 
-                 ha='center', va='center', 
-                 transform=plt.gca().transAxes, 
-                 fontsize=14)
+    no_data_text.set_visible(not has_data)
 
     # Adjust layout to make room for the legend
-    plt.tight_layout()
-    plt.savefig('{}_response_times.png'.format(wifi_type), bbox_inches='tight', dpi=300)
-    plt.close()
+    fig.tight_layout()
+    # Per-group grid views don't need print resolution; the comparison chart keeps 300 dpi
+    fig.savefig('{}_response_times.png'.format(wifi_type), bbox_inches='tight', dpi=150)
 
 
 def plot_wifi_comparison(wifi6_delays, wifi4_delays, y_min, y_max):
     """Create a plot comparing WiFi 6 vs WiFi 4 performance"""
+    plt = load_pyplot()
+
     plt.figure(figsize=(15, 8))
     plt.ylim(y_min, y_max)
     
@@ -483,7 +1166,7 @@ def plot_wifi_comparison(wifi6_delays, wifi4_delays, y_min, y_max):
     wifi6_all_delays = []
     wifi6_colors = plt.cm.Blues(np.linspace(0.4, 0.8, len(wifi6_delays) or 1))
     for i, (ip, delays) in enumerate(wifi6_delays.items()):
-        if delays:
+        if len(delays):
             wifi6_all_delays.extend(delays)
             x = np.arange(1, len(delays) + 1)
             avg_delay = np.mean(delays)
@@ -496,7 +1179,7 @@ def plot_wifi_comparison(wifi6_delays, wifi4_delays, y_min, y_max):
     wifi4_all_delays = []
     wifi4_colors = plt.cm.Reds(np.linspace(0.4, 0.8, len(wifi4_delays) or 1))
     for i, (ip, delays) in enumerate(wifi4_delays.items()):
-        if delays:
+        if len(delays):
             wifi4_all_delays.extend(delays)
             x = np.arange(1, len(delays) + 1)
             avg_delay = np.mean(delays)
@@ -554,148 +1237,172 @@ def plot_wifi_comparison(wifi6_delays, wifi4_delays, y_min, y_max):
     plt.close()
 
 
-def send_commands_to_devices_by_type(devices_dict, wifi_mode, r, g, b, seq, send_sock, thread_name):
-    """Send commands only to devices of a specific WiFi mode"""
-    print(f"\n [{thread_name}] Sending color: RGB({r},{g},{b}) to WiFi {wifi_mode} devices")
-    
-    # Filter devices by WiFi mode
-    target_devices = {ip: info for ip, info in devices_dict.items() 
-                      if info[1] == wifi_mode}
+def send_commands_to_devices_by_type(target_devices, wifi_mode, r, g, b, seq, send_sock, label):
+    """Send commands to target_devices, the already filtered devices of one WiFi mode"""
+    print(f"\n [{label}] Sending color: RGB({r},{g},{b}) to WiFi {wifi_mode} devices")
     
     if not target_devices:
-        print(f" [{thread_name}] No WiFi {wifi_mode} devices found")
+        print(f" [{label}] No WiFi {wifi_mode} devices found")
         return
         
-    print(f" [{thread_name}] Sending to {len(target_devices)} device(s)")
+    print(f" [{label}] Sending to {len(target_devices)} device(s)")
     
-    # Send commands to all devices of this type
-    for ip in target_devices:
-        t1 = send_color_command(ip, r, g, b, seq, send_sock)
-        pending_commands[(ip, seq)] = t1
-        # Small delay between sends to different devices
-        #time.sleep(0.001)
+    # Send commands to all devices of this type in one batch
+    open_round(seq, target_devices)
+    send_color_command_to_devices(target_devices, r, g, b, seq, send_sock)
     
-    print(f" [{thread_name}] Completed sending commands")
+    print(f" [{label}] Completed sending commands")
 
 
-def run_wifi_type_test(wifi_mode, iterations, colors, global_seq):
-    """Run test for a specific WiFi type in a separate thread"""
-    thread_name = f"WiFi {wifi_mode}"
-    print(f"\n Starting {thread_name} thread with {iterations} iterations")
-    
-    # Create a thread-local socket for sending
-    send_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+def run_wifi_tests(iterations, colors, resp_sock, cpu=None):
+    """Run every WiFi type's rounds from the calling thread.
+
+    Rounds go out on fixed ROUND_INTERVAL_NS ticks of the monotonic clock. Each
+    round sends to all modes, then handles responses inline until they are all in
+    (or ROUND_TIMEOUT passes) and its tick has come, so no threads compete for the
+    GIL and the log order is deterministic.
+    """
+    # Stay on the CPU that handles the NIC's RX queue so socket state stays cache-hot,
+    # and don't let other processes preempt the loop that stamps responses
+    saved_affinity = pin_receiver_to_cpu(cpu)
+    saved_priority = raise_receiver_priority()
+
+    # Filter devices by WiFi mode once; the same dicts are reused every round, which
+    # also lets command_batch keep their prepared sendmmsg headers
+    modes = []
+    for wifi_mode, seq_start in ((6, WIFI6_SEQ_START), (4, WIFI4_SEQ_START)):
+        target_devices = {ip: info for ip, info in discovered_devices.items()
+                          if info[1] == wifi_mode}
+        if target_devices:
+            modes.append((wifi_mode, seq_start, target_devices))
+            print(f"\n Starting WiFi {wifi_mode} test with {iterations} iterations")
+
+    # Reused for every receive call instead of allocating per packet; responses are
+    # only RESP_STRUCT.size bytes, anything longer than a slot is truncated
+    batch = make_recv_batch()
+    selector = selectors.DefaultSelector()
+    selector.register(resp_sock, selectors.EVENT_READ)
+
     try:
+        next_tick = time.monotonic_ns()
         for i in range(iterations):
+            # A round that overran its tick waiting on stragglers starts a new grid
+            # from its own send, rather than the next rounds firing back to back
+            next_tick = max(next_tick, time.monotonic_ns()) + ROUND_INTERVAL_NS
             r, g, b = colors[i % len(colors)]
-            seq = global_seq + i
-            send_commands_to_devices_by_type(discovered_devices, wifi_mode, r, g, b, seq, send_sock, thread_name)
-            # Give time for responses
-            time.sleep(1.5)
+            for wifi_mode, seq_start, target_devices in modes:
+                send_commands_to_devices_by_type(target_devices, wifi_mode, r, g, b, seq_start + i,
+                                                 unicast_sock, f"WiFi {wifi_mode}")
+            # Handle responses until every device answered (or ROUND_TIMEOUT) and the
+            # next tick is due, whichever comes later
+            wait_for_round(selector, resp_sock, batch, next_tick)
+
+        # Pick up anything that arrived after the last round gave up waiting
+        drain_responses(resp_sock, batch)
     finally:
-        send_sock.close()
-    
-    print(f" {thread_name} thread completed")
+        selector.close()
+        restore_receiver_scheduling(saved_affinity, saved_priority)
+    # Per-response lines are opt-in; the summary and plots come from the recorded data
+    if VERBOSE:
+        write_response_log()
+
+    for wifi_mode, _, _ in modes:
+        print(f" WiFi {wifi_mode} test completed")
 
 
 def main():
     print(f" Starting {WIFI_TYPE} testing with {MEASUREMENT_ITERATIONS} iterations")
     num_iterations = 1
-    for _ in range(num_iterations):
-        sync_time_with_ntp()
-        send_broadcast_and_collect_responses()
-        if not discovered_devices:
-            print("⚠️ No devices found. Exiting.")
-            return
-            
-        # Check if we have both WiFi 4 and WiFi 6 devices
-        wifi6_devices = {ip: info for ip, info in discovered_devices.items() if info[1] == 6}
-        wifi4_devices = {ip: info for ip, info in discovered_devices.items() if info[1] != 6}
-        
-        print(f"\n Found {len(wifi6_devices)} WiFi 6 device(s) and {len(wifi4_devices)} WiFi 4 device(s)")
-        
-        # Set up a global stop event and response queue for the listener
-        global_stop_event = threading.Event()
-        response_queue = []
-        
-        # Start the continuous listener thread
-        listener = threading.Thread(
-            target=response_listener_continuous, 
-            args=(global_stop_event, response_queue)
-        )
-        listener.daemon = True
-        listener.start()
-        print(" Response listener thread started...")
-        
-        # Define starting sequence numbers for each WiFi type to avoid conflicts
-        wifi6_seq_start = 1000
-        wifi4_seq_start = 2000
-        
-        # Create threads for each WiFi type
-        threads = []
-        
-        if wifi6_devices:
-            wifi6_thread = threading.Thread(
-                target=run_wifi_type_test,
-                args=(6, MEASUREMENT_ITERATIONS, COLORS, wifi6_seq_start)
-            )
-            threads.append(wifi6_thread)
+    # The response socket is bound once for the whole run
+    resp_sock = open_response_socket()
+    try:
+        for _ in range(num_iterations):
+            sync_time_with_ntp()
+            send_broadcast_and_collect_responses()
+            if not discovered_devices:
+                print("⚠️ No devices found. Exiting.")
+                return
             
-        if wifi4_devices:
-            wifi4_thread = threading.Thread(
-                target=run_wifi_type_test,
-                args=(4, MEASUREMENT_ITERATIONS, COLORS, wifi4_seq_start)
-            )
-            threads.append(wifi4_thread)
+            allocate_delay_buffers()
+
+            # Check if we have both WiFi 4 and WiFi 6 devices
+            wifi6_devices = {ip: info for ip, info in discovered_devices.items() if info[1] == 6}
+            wifi4_devices = {ip: info for ip, info in discovered_devices.items() if info[1] != 6}
         
-        # Start all threads
-        for thread in threads:
-            thread.start()
+            print(f"\n Found {len(wifi6_devices)} WiFi 6 device(s) and {len(wifi4_devices)} WiFi 4 device(s)")
+
+            run_wifi_tests(MEASUREMENT_ITERATIONS, COLORS, resp_sock, find_rx_cpu())
+
+            print_average_delays()
+    finally:
+        resp_sock.close()
+
+    print("Completed all iterations.")
+
+
+def recorded_delays():
+    """Build the same (all, WiFi 6, WiFi 4) per-IP delay dicts as analyze_wifi_time,
+    straight from response_records instead of re-parsing the log"""
+    records = response_records[:response_count]
+    # Stable sort by device keeps each device's delays in the order they were handled
+    order = np.argsort(records['idx'], kind='stable')
+    counts = np.bincount(records['idx'], minlength=len(device_ips))
+    groups = np.split(records['delay'][order], np.cumsum(counts)[:-1])
+
+    ip_delays = {}
+    wifi6_ip_delays = {}
+    wifi4_ip_delays = {}
+    for idx, delays in enumerate(groups):
+        if not len(delays):
+            continue
+        ip = device_ips[idx]
+        ip_delays[ip] = delays
+        if device_wifi_modes[idx] == 6:
+            wifi6_ip_delays[ip] = delays
+        else:
+            wifi4_ip_delays[ip] = delays
+    return ip_delays, wifi6_ip_delays, wifi4_ip_delays
+
+
+def plot_delays(ip_delays, wifi6_delays, wifi4_delays):
+    """Generate all plots from per-IP delay dicts"""
+    # y_min = 0
+    # y_max = 400
+    y_min = None
+    y_max = None
+    # Generate regular plot for all devices
+    plot_wifi_data(ip_delays, WIFI_TYPE, y_min, y_max)
+    
+    # Generate separate plots for WiFi 6 devices
+    if len(wifi6_delays) > 0:
+        plot_wifi_data(wifi6_delays, "WiFi6", y_min, y_max)
         
-        # Wait for all threads to complete
-        for thread in threads:
-            thread.join()
+    # Generate separate plots for WiFi 4 devices
+    if len(wifi4_delays) > 0:
+        plot_wifi_data(wifi4_delays, "WiFi4", y_min, y_max)
         
-        # Clean up the listener
-        print(" Waiting for final responses...")
-        time.sleep(2)  # Give time for last responses
-        global_stop_event.set()
-        listener.join()
-        print(" Response listener thread ended")
+    # Generate comparison plot if we have both types of devices
+    if len(wifi6_delays) > 0 and len(wifi4_delays) > 0:
+        plot_wifi_comparison(wifi6_delays, wifi4_delays, 0, 600)
 
-        print_average_delays()
 
-    print("Completed all iterations.")
+def plot_results(log_path):
+    """Analyze a finished log file and generate all plots (post-hoc, e.g. for old logs)"""
+    plot_delays(*analyze_wifi_time(log_path, WIFI_TYPE))
 
 
 if __name__ == "__main__":
-    try:
-        main()
-    finally:
-        # Ensure the log file is closed properly
-        log_file.close()
-        sys.stdout = sys.__stdout__
-        sys.stderr = sys.__stderr__
-
-        # Automatically analyze the log file and generate plots
-        ip_delays, wifi6_delays, wifi4_delays = analyze_wifi_time(log_file_path, WIFI_TYPE)
-
-        # y_min = 0
-        # y_max = 400
-        y_min = None
-        y_max = None
-        # Generate regular plot for all devices
-        plot_wifi_data(ip_delays, WIFI_TYPE, y_min, y_max)
-        
-        # Generate separate plots for WiFi 6 devices
-        if len(wifi6_delays) > 0:
-            plot_wifi_data(wifi6_delays, "WiFi6", y_min, y_max)
-            
-        # Generate separate plots for WiFi 4 devices
-        if len(wifi4_delays) > 0:
-            plot_wifi_data(wifi4_delays, "WiFi4", y_min, y_max)
-            
-        # Generate comparison plot if we have both types of devices
-        if len(wifi6_delays) > 0 and len(wifi4_delays) > 0:
-            plot_wifi_comparison(wifi6_delays, wifi4_delays, 0, 600)
+    if PLOT_ONLY_LOG is not None:
+        plot_results(PLOT_ONLY_LOG)
+    else:
+        try:
+            main()
+        finally:
+            # Ensure the log file is closed properly
+            log_file.close()
+            sys.stdout = sys.__stdout__
+            sys.stderr = sys.__stderr__
 
+            # The measurement is over, so plot from the recorded responses directly;
+            # --plot-only LOG_FILE still rebuilds the same plots from a saved log
+            plot_delays(*recorded_delays())